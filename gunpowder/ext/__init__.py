@@ -52,6 +52,11 @@ try:
 except ImportError as e:
     malis = NoSuchModule('malis')
 
+try:
+    import numba
+except ImportError as e:
+    numba = NoSuchModule('numba')
+
 try:
     import augment
 except ImportError as e:
@@ -21,6 +21,7 @@ from .klb_source import KlbSource
 from .merge_provider import MergeProvider
 from .noise_augment import NoiseAugment
 from .normalize import Normalize
+from .normalize_and_reject_constant import NormalizeAndRejectConstant
 from .pad import Pad
 from .precache import PreCache
 from .print_profiling_stats import PrintProfilingStats
@@ -28,6 +29,7 @@ from .random_location import RandomLocation
 from .random_provider import RandomProvider
 from .rasterize_graph import RasterizationSettings, RasterizeGraph
 from .reject import Reject
+from .reject_constant import RejectConstant
 from .renumber_connected_components import RenumberConnectedComponents
 from .scan import Scan
 from .shift_augment import ShiftAugment
@@ -0,0 +1,80 @@
+'''Numba-jitted inner kernels shared by performance-sensitive nodes.
+
+The kernels are compiled with ``cache=True``, so they compile once per
+machine and are reloaded from the on-disk cache afterwards. If numba is not
+installed, every kernel in this module is ``None`` and the nodes fall back
+to their NumPy implementations.
+'''
+
+import numpy as np
+
+from gunpowder.ext import numba, NoSuchModule
+
+if not isinstance(numba, NoSuchModule):
+
+    # gunpowder forks worker processes (ProducerPool). numba's OpenMP and
+    # TBB threading layers both deadlock the process at interpreter
+    # shutdown once a parallel kernel has run before a fork; the built-in
+    # workqueue layer is the only one that survives this, so pin it before
+    # any kernel executes. An explicitly configured layer (via the
+    # NUMBA_THREADING_LAYER environment variable or an assignment to
+    # numba.config) shows up as a non-default value here and is respected
+    if numba.config.THREADING_LAYER == 'default':
+        numba.config.THREADING_LAYER = 'workqueue'
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def scale(data, factor, out):
+        '''Cast and scale ``data`` into ``out`` in a single pass.'''
+        for i in numba.prange(data.size):
+            out[i] = data[i]*factor
+
+    # uint8 raw to float32 is the dominant case in training pipelines, so
+    # compile it eagerly for contiguous arrays: the explicit signature
+    # avoids the first-batch JIT pause and lets LLVM emit the packed
+    # cvt+mul loop directly
+    @numba.njit(
+        ['void(uint8[::1], float32, float32[::1])'],
+        parallel=True, fastmath=True, cache=True)
+    def scale_u8_f32(data, factor, out):
+        for i in numba.prange(data.size):
+            out[i] = data[i]*factor
+
+    @numba.njit(parallel=True, cache=True)
+    def minmax(data):
+        '''Minimum and maximum of ``data`` in a single pass.'''
+        lo = data[0]
+        hi = data[0]
+        for i in numba.prange(data.size):
+            lo = min(lo, data[i])
+            hi = max(hi, data[i])
+        return lo, hi
+
+    @numba.njit(fastmath=True, cache=True)
+    def min_coefvar(data, threshold):
+        '''Smallest coefficient of variation over the rows of ``data``,
+        computed with a single Welford pass per row. Returns as soon as one
+        row falls at or below ``threshold``, since that already decides the
+        rejection.'''
+        min_coefvar = np.inf
+        for row in range(data.shape[0]):
+            n = 0
+            mean = 0.0
+            m2 = 0.0
+            for i in range(data.shape[1]):
+                x = data[row, i]
+                n += 1
+                delta = x - mean
+                mean += delta/n
+                m2 += delta*(x - mean)
+            coefvar = np.sqrt(m2/n)/max(abs(mean), 1e-10)
+            min_coefvar = min(min_coefvar, coefvar)
+            if min_coefvar <= threshold:
+                return min_coefvar
+        return min_coefvar
+
+else:
+
+    scale = None
+    scale_u8_f32 = None
+    minmax = None
+    min_coefvar = None
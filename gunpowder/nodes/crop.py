@@ -1,6 +1,8 @@
 import copy
 import logging
 
+import numpy as np
+
 from .batch_filter import BatchFilter
 from gunpowder.coordinate import Coordinate
 
@@ -69,18 +71,32 @@ class Crop(BatchFilter):
 
         else:
 
-            total_fraction = tuple(
-                n + p
-                for n, p in zip(self.fraction_negative, self.fraction_positive)
-            )
-            if max(total_fraction) >= 1:
+            shape = np.asarray(spec.roi.get_shape(), dtype=np.int64)
+            fraction_positive = np.asarray(self.fraction_positive)
+            fraction_negative = np.asarray(self.fraction_negative)
+
+            if np.max(fraction_negative + fraction_positive) >= 1:
                 raise RuntimeError("Sum of crop fractions exeeds 1")
 
-            crop_positive = spec.roi.get_shape()*self.fraction_positive
-            crop_negative = spec.roi.get_shape()*self.fraction_negative
+            # an all-zero fraction (the default for the side that was not
+            # given) crops nothing: skip the float multiply so the shape
+            # never takes a round trip through floats
+            if fraction_positive.any():
+                crop_positive = (shape*fraction_positive).astype(np.int64)
+            else:
+                crop_positive = np.zeros_like(shape)
+            if fraction_negative.any():
+                crop_negative = (shape*fraction_negative).astype(np.int64)
+            else:
+                crop_negative = np.zeros_like(shape)
+
+            if np.any(crop_positive + crop_negative >= shape):
+                raise RuntimeError(
+                    "Crop fractions leave no ROI in at least one dimension")
+
             cropped_roi = spec.roi.grow(
-                -crop_positive,
-                -crop_negative)
+                Coordinate(-crop_positive),
+                Coordinate(-crop_negative))
 
         spec.roi = cropped_roi
         self.updates(self.key, spec)
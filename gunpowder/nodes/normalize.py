@@ -4,10 +4,57 @@ import numpy as np
 
 from gunpowder.batch_request import BatchRequest
 
+from . import _kernels
 from .batch_filter import BatchFilter
 
 logger = logging.getLogger(__name__)
 
+
+def _scale(data, factor, dtype, out=None):
+    '''Cast ``data`` to ``dtype`` and multiply by ``factor`` in a single
+    pass, avoiding the intermediate array that ``data.astype(dtype)*factor``
+    would allocate and traverse a second time. If ``out`` is given, the
+    result is written into it instead of a freshly allocated array.'''
+
+    if data.dtype == dtype and factor == 1:
+        return data
+
+    if out is None:
+        out = np.empty(data.shape, dtype=dtype)
+    if data.dtype == dtype:
+        # already the target dtype: no cast needed, but still write into
+        # a separate array — upstream may have handed out a view into
+        # stored data, which an in-place multiply would corrupt
+        np.multiply(data, factor, out=out)
+        return out
+    if out.dtype == np.float16:
+        # half-precision output halves the bytes every downstream node
+        # moves; the ufunc still computes in float32 (the common type of
+        # the input and the float32 factor) and narrows only at store time
+        np.multiply(data, np.float32(factor), out=out, casting='unsafe')
+        return out
+    if _kernels.scale is not None and data.flags.c_contiguous:
+        if data.dtype == np.uint8 and out.dtype == np.float32:
+            _kernels.scale_u8_f32(
+                data.reshape(-1), np.float32(factor), out.reshape(-1))
+        else:
+            _kernels.scale(
+                data.reshape(-1), out.dtype.type(factor), out.reshape(-1))
+    else:
+        np.multiply(data, factor, out=out, casting='unsafe')
+    return out
+
+
+def _range(data):
+    '''Minimum and maximum of ``data``, computed in a single pass where
+    numba is available instead of two separate full reductions.'''
+
+    if (_kernels.minmax is not None
+            and data.flags.c_contiguous
+            and data.size > 0):
+        return _kernels.minmax(data.reshape(-1))
+    return data.min(), data.max()
+
 class Normalize(BatchFilter):
     '''Normalize the values of an array to be floats between 0 and 1, based on
     the type of the array.
@@ -26,21 +73,79 @@ class Normalize(BatchFilter):
 
         dtype (data-type, optional):
 
-            The datatype of the normalized array. Defaults to ``np.float32``.
+            The datatype of the normalized array. Defaults to
+            ``np.float32``. ``np.float16`` is supported to halve the
+            bandwidth of all downstream nodes; the scaling itself is still
+            computed in float32 and only narrowed when stored.
+
+        reuse_buffer (``bool``, optional):
+
+            If set, one output buffer is allocated on the first batch and
+            reused for every following batch of the same shape, instead of
+            allocating a fresh array per batch. Only safe if no downstream
+            node holds on to the array data across batches. Defaults to
+            ``False``.
     '''
 
-    def __init__(self, array, factor=None, dtype=np.float32):
+    def __init__(self, array, factor=None, dtype=np.float32,
+                 reuse_buffer=False):
 
         self.array = array
         self.factor = factor
         self.dtype = dtype
+        self.reuse_buffer = reuse_buffer
+        self._out_buf = None
 
     def setup(self):
         self.enable_autoskip()
         array_spec = copy.deepcopy(self.spec[self.array])
+        upstream_dtype = array_spec.dtype
         array_spec.dtype = self.dtype
         self.updates(self.array, array_spec)
 
+        # dispatch table for the automatic factor, built once so that
+        # process does a single dict lookup instead of re-running the
+        # dtype comparison chain on every batch
+        self._auto_factor = {
+            np.dtype(np.uint8): lambda data: 1.0/255,
+            np.dtype(np.uint16): lambda data: 1.0/(256*256 - 1),
+            np.dtype(np.float32): self._float32_factor,
+        }
+
+        # everything that depends only on the upstream spec is resolved
+        # here, so the per-batch path is a single call
+        if self.factor is not None:
+            self._factor_fn = lambda data: self.factor
+        elif upstream_dtype is not None:
+            # specs may carry either a dtype instance or a scalar type
+            upstream_dtype = np.dtype(upstream_dtype)
+            if upstream_dtype not in self._auto_factor:
+                raise RuntimeError("Automatic normalization for " +
+                        str(upstream_dtype) + " not implemented, please "
+                        "provide a factor.")
+            self._factor_fn = self._auto_factor[upstream_dtype]
+        else:
+            # upstream does not declare a dtype, resolve per batch
+            self._factor_fn = self._detect_factor
+
+    def _float32_factor(self, data):
+        data_min, data_max = _range(data)
+        assert data_min >= 0 and data_max <= 1, (
+                "Values are float but not in [0,1], I don't know how "
+                "to normalize. Please provide a factor.")
+        return 1.0
+
+    def _detect_factor(self, data):
+        logger.debug("automatically normalizing %s with dtype=%s",
+                self.array, data.dtype)
+        try:
+            factor_fn = self._auto_factor[data.dtype]
+        except KeyError:
+            raise RuntimeError("Automatic normalization for " +
+                    str(data.dtype) + " not implemented, please "
+                    "provide a factor.")
+        return factor_fn(data)
+
     def prepare(self, request):
         deps = BatchRequest()
         deps[self.array] = request[self.array]
@@ -52,28 +157,18 @@ class Normalize(BatchFilter):
         if self.array not in batch.arrays:
             return
 
-        factor = self.factor
         array = batch.arrays[self.array]
         array.spec.dtype = self.dtype
-
-        if factor is None:
-
-            logger.debug("automatically normalizing %s with dtype=%s",
-                    self.array, array.data.dtype)
-
-            if array.data.dtype == np.uint8:
-                factor = 1.0/255
-            elif array.data.dtype == np.uint16:
-                factor = 1.0/(256*256-1)
-            elif array.data.dtype == np.float32:
-                assert array.data.min() >= 0 and array.data.max() <= 1, (
-                        "Values are float but not in [0,1], I don't know how "
-                        "to normalize. Please provide a factor.")
-                factor = 1.0
-            else:
-                raise RuntimeError("Automatic normalization for " +
-                        str(array.data.dtype) + " not implemented, please "
-                        "provide a factor.")
+        factor = self._factor_fn(array.data)
 
         logger.debug("scaling %s with %f", self.array, factor)
-        array.data = array.data.astype(self.dtype)*factor
+
+        out = None
+        if self.reuse_buffer and (
+                array.data.dtype != self.dtype or factor != 1):
+            if (self._out_buf is None
+                    or self._out_buf.shape != array.data.shape):
+                self._out_buf = np.empty(array.data.shape, dtype=self.dtype)
+            out = self._out_buf
+
+        array.data = _scale(array.data, factor, self.dtype, out=out)
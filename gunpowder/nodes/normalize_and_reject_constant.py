@@ -0,0 +1,221 @@
+import logging
+import random
+
+import numpy as np
+
+from gunpowder.profiling import Timing
+
+from .batch_filter import BatchFilter
+
+logger = logging.getLogger(__name__)
+
+# tile size for the fused traversal, chosen to keep one input and one
+# output tile L2-resident together
+_TILE_BYTES = 256*1024
+
+_AUTO_FACTORS = {
+    np.dtype(np.uint8): 1.0/255,
+    np.dtype(np.uint16): 1.0/(256*256 - 1),
+}
+
+
+class NormalizeAndRejectConstant(BatchFilter):
+    '''Fused :class:`Normalize` plus :class:`RejectConstant`.
+
+    Running the two nodes back to back reads every batch from RAM twice:
+    once to scale it and once to compute the rejection statistics. This
+    node walks the batch in tiles small enough to stay in cache, normalizes
+    each tile and accumulates the coefficient-of-variation statistics from
+    the still-hot normalized values (the coefficient is invariant under the
+    positive scaling, so the statistics of the normalized data decide the
+    rejection exactly as the raw data would). Each byte is read from RAM
+    once for both nodes' work.
+
+    Args:
+
+        array (:class:`ArrayKey`):
+
+            The key of the array to normalize and inspect.
+
+        factor (scalar, optional):
+
+            The normalization factor. If not given, a factor is chosen
+            based on the upstream ``dtype`` (``np.uint8`` or ``np.uint16``).
+
+        dtype (data-type, optional):
+
+            The datatype of the normalized array. Defaults to
+            ``np.float32``.
+
+        min_coefvar (``float``, optional):
+
+            The minimal required coefficient of variation, as in
+            :class:`RejectConstant`. Defaults to 1e-4.
+
+        axis (``int``, optional):
+
+            The axis of the (squeezed) array to compute the coefficient of
+            variation over, as in :class:`RejectConstant`. If not given, a
+            single coefficient is computed over the whole array.
+
+        reject_probability (``float``, optional):
+
+            The probability by which a batch that is not valid is actually
+            rejected. Defaults to 1., i.e. strict rejection.
+    '''
+
+    def __init__(
+            self,
+            array,
+            factor=None,
+            dtype=np.float32,
+            min_coefvar=1e-4,
+            axis=None,
+            reject_probability=1.):
+
+        self.array = array
+        self.factor = factor
+        self.dtype = dtype
+        self.min_coefvar = min_coefvar
+        self.axis = axis
+        self.reject_probability = reject_probability
+
+    def setup(self):
+        assert self.array in self.spec, (
+            "NormalizeAndRejectConstant can only be used if %s is provided"
+            % self.array)
+        self.upstream_provider = self.get_upstream_provider()
+
+        spec = self.spec[self.array].copy()
+        spec.dtype = self.dtype
+        self.updates(self.array, spec)
+
+    def provide(self, request):
+        random.seed(request.random_seed)
+
+        report_next_timeout = 10
+        num_rejected = 0
+
+        timing = Timing(self)
+        timing.start()
+
+        assert self.array in request, (
+            "NormalizeAndRejectConstant can only be used if %s is requested"
+            % self.array)
+
+        # the upstream array comes in its native dtype
+        upstream_request = request.copy()
+        upstream_request[self.array].dtype = None
+
+        have_good_batch = False
+        while not have_good_batch:
+
+            batch = self.upstream_provider.request_batch(upstream_request)
+            array = batch.arrays[self.array]
+
+            out, min_coefvar = self._normalize_and_min_coefvar(array.data)
+
+            have_good_batch = min_coefvar > self.min_coefvar
+
+            if not have_good_batch and self.reject_probability < 1.:
+                have_good_batch = random.random() > self.reject_probability
+
+            if not have_good_batch:
+                logger.debug(
+                    "reject batch with min coefvar %f at %s",
+                    min_coefvar, array.spec.roi)
+                num_rejected += 1
+
+                if timing.elapsed() > report_next_timeout:
+
+                    logger.warning(
+                        "rejected %d batches, been waiting for a good one "
+                        "since %ds", num_rejected, report_next_timeout)
+                    report_next_timeout *= 2
+
+            else:
+                logger.debug(
+                    "accepted batch with min coefvar %f at %s",
+                    min_coefvar, array.spec.roi)
+
+        array.data = out
+        array.spec.dtype = self.dtype
+
+        timing.stop()
+        batch.profiling_stats.add(timing)
+
+        return batch
+
+    def _normalize_and_min_coefvar(self, data):
+        '''Normalize ``data`` into a fresh array of ``self.dtype`` and
+        compute the smallest coefficient of variation along ``self.axis``,
+        in one tiled pass over the data.'''
+
+        factor = self.factor
+        if factor is None:
+            try:
+                factor = _AUTO_FACTORS[data.dtype]
+            except KeyError:
+                raise RuntimeError("Automatic normalization for " +
+                        str(data.dtype) + " not implemented, please "
+                        "provide a factor.")
+
+        out = np.empty(data.shape, dtype=self.dtype)
+
+        # RejectConstant computes its statistics on the squeezed array;
+        # work on squeezed views (no copies) of input and output here so
+        # axis selects the same dimension in both nodes
+        full_out = out
+        data = data.squeeze()
+        out = out.squeeze()
+        if data.ndim == 0:
+            data = data.reshape(1)
+            out = out.reshape(1)
+
+        axis = self.axis % data.ndim if self.axis is not None else None
+        n = data.size if axis is None else data.shape[axis]
+
+        # per-tile rows along the outermost axis such that one input and
+        # one output tile fit in L2 together
+        row_bytes = (data.nbytes + out.nbytes)//max(1, data.shape[0])
+        tile_rows = max(1, _TILE_BYTES//max(1, row_bytes))
+
+        if axis is None:
+            s = 0.0
+            ss = 0.0
+        elif axis == 0:
+            s = np.zeros(data.shape[1:], dtype=np.float64)
+            ss = np.zeros(data.shape[1:], dtype=np.float64)
+        else:
+            out_shape = (
+                data.shape[:axis] + data.shape[axis + 1:])
+            s = np.empty(out_shape, dtype=np.float64)
+            ss = np.empty(out_shape, dtype=np.float64)
+
+        for i in range(0, data.shape[0], tile_rows):
+
+            tile = data[i:i + tile_rows]
+            tile_out = out[i:i + tile_rows]
+            np.multiply(
+                tile, np.float32(factor), out=tile_out, casting='unsafe')
+
+            # accumulate the rejection statistics from the normalized
+            # tile while it is still cache-resident
+            if axis is None:
+                flat = tile_out.reshape(-1)
+                s += flat.sum(dtype=np.float64)
+                ss += np.einsum('i,i->', flat, flat, dtype=np.float64)
+            elif axis == 0:
+                s += tile_out.sum(axis=0, dtype=np.float64)
+                ss += np.einsum(
+                    'i...,i...->...', tile_out, tile_out, dtype=np.float64)
+            else:
+                moved = np.moveaxis(tile_out, axis, -1)
+                s[i:i + tile_rows] = moved.sum(axis=-1, dtype=np.float64)
+                ss[i:i + tile_rows] = np.einsum(
+                    '...i,...i->...', moved, moved, dtype=np.float64)
+
+        mean = np.divide(s, n)
+        var = np.maximum(np.divide(ss, n) - mean*mean, 0)
+        coefvar = np.sqrt(var)/np.clip(np.abs(mean), 1e-10, None)
+        return full_out, float(np.min(coefvar))
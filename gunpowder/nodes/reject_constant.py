@@ -0,0 +1,302 @@
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from gunpowder.profiling import Timing
+
+from . import _kernels
+from .batch_filter import BatchFilter
+
+logger = logging.getLogger(__name__)
+
+
+class RejectConstant(BatchFilter):
+    '''Reject batches in which the given array is (close to) constant.
+
+    Rejection is based on the coefficient of variation (standard deviation
+    over mean) of the array values. If ``axis`` is given, the coefficient is
+    computed per position along the remaining axes (reducing over ``axis``),
+    and the minimum over positions is compared against ``min_coefvar``. This
+    catches, e.g., individual missing sections in EM volumes.
+
+    Args:
+
+        array (:class:`ArrayKey`):
+
+            The key of the array to inspect.
+
+        min_coefvar (``float``, optional):
+
+            The minimal required coefficient of variation. Batches in which
+            the coefficient (or its minimum over positions, if ``axis`` is
+            given) is at or below this value are rejected. Defaults to 1e-4.
+
+        axis (``int``, optional):
+
+            The axis of the (squeezed) array to compute the coefficient of
+            variation over. If not given, a single coefficient is computed
+            over the whole array.
+
+        reject_probability (``float``, optional):
+
+            The probability by which a batch that is not valid is actually
+            rejected. Defaults to 1., i.e. strict rejection.
+
+        prefilter_stride (``int``, optional):
+
+            If given, the coefficient of variation is first estimated on a
+            view strided by this factor in every dimension, touching only a
+            small fraction of the data. Only if the estimate lands within a
+            factor of two of ``min_coefvar`` is the full-resolution
+            computation performed. Set to ``None`` to always compute at
+            full resolution. Defaults to 4.
+
+        prefetch (``bool``, optional):
+
+            If set, keep one upstream request in flight while the current
+            candidate batch is inspected, so that on rejection the next
+            candidate is already being fetched. Hides upstream latency on
+            rejection-heavy pipelines, at the cost of one extra (discarded)
+            upstream batch per accepted batch. Requires the upstream part
+            of the pipeline to be safe to call from a worker thread.
+            Defaults to ``False``.
+    '''
+
+    def __init__(
+            self,
+            array,
+            min_coefvar=1e-4,
+            axis=None,
+            reject_probability=1.,
+            prefilter_stride=4,
+            prefetch=False):
+
+        self.array = array
+        self.min_coefvar = min_coefvar
+        self.axis = axis
+        self.reject_probability = reject_probability
+        self.prefilter_stride = prefilter_stride
+        self.prefetch = prefetch
+        self._executor = None
+        self._mean_buf = None
+        self._std_buf = None
+
+    def setup(self):
+        assert self.array in self.spec, (
+            "RejectConstant can only be used if %s is provided" % self.array)
+        self.upstream_provider = self.get_upstream_provider()
+        if self.prefetch:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def teardown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def provide(self, request):
+        random.seed(request.random_seed)
+
+        report_next_timeout = 10
+        num_rejected = 0
+
+        timing = Timing(self)
+        timing.start()
+
+        assert self.array in request, (
+            "RejectConstant can only be used if %s is requested" % self.array)
+
+        have_good_batch = False
+        pending = None
+        while not have_good_batch:
+
+            if self._executor is not None:
+                if pending is None:
+                    pending = self._prefetch(request)
+                batch = pending.result()
+                # keep the next candidate in flight while this one is
+                # inspected, so a rejection does not wait on upstream
+                pending = self._prefetch(request)
+            else:
+                batch = self.upstream_provider.request_batch(request)
+
+            data = batch.arrays[self.array].data.squeeze()
+            min_coefvar = self._min_coefvar(data)
+
+            have_good_batch = min_coefvar > self.min_coefvar
+
+            if not have_good_batch and self.reject_probability < 1.:
+                have_good_batch = random.random() > self.reject_probability
+
+            if not have_good_batch:
+                logger.debug(
+                    "reject batch with min coefvar %f at %s",
+                    min_coefvar, batch.arrays[self.array].spec.roi)
+                num_rejected += 1
+
+                if timing.elapsed() > report_next_timeout:
+
+                    logger.warning(
+                        "rejected %d batches, been waiting for a good one "
+                        "since %ds", num_rejected, report_next_timeout)
+                    report_next_timeout *= 2
+
+            else:
+                logger.debug(
+                    "accepted batch with min coefvar %f at %s",
+                    min_coefvar, batch.arrays[self.array].spec.roi)
+
+        if pending is not None:
+            # a candidate for this request may still be in flight; it can
+            # not be returned for a future request, so drop it (cancelled
+            # if it has not started, discarded on completion otherwise)
+            pending.cancel()
+
+        timing.stop()
+        batch.profiling_stats.add(timing)
+
+        return batch
+
+    def _prefetch(self, request):
+        '''Submit an upstream request on a copy of ``request``, so the
+        worker thread never touches the caller's request object (an
+        in-flight fetch can outlive this provide call). The seed is
+        advanced here, in the calling thread, so successive candidates
+        still see distinct seeds.'''
+
+        request._update_random_seed()
+        return self._executor.submit(
+            self.upstream_provider.request_batch, request.copy())
+
+    def _min_coefvar(self, data):
+        '''Smallest coefficient of variation of ``data`` along ``self.axis``
+        (or over the whole array, if ``self.axis`` is ``None``).'''
+
+        # if the array lives on a GPU (cupy array or torch tensor), reduce
+        # it on the device and only transfer the single resulting scalar,
+        # instead of pulling the whole batch across PCIe per iteration
+        module = type(data).__module__
+        if module.startswith('cupy') or module.startswith('torch'):
+            return self._min_coefvar_device(data, is_torch='torch' in module)
+
+        # rejected batches are discarded entirely, so the decision rarely
+        # needs an exact coefvar: estimate it on a strided view first and
+        # only fall through to full resolution if the estimate is too close
+        # to the threshold to call. Only the reduction axis is strided:
+        # every position along the other axes must stay visible, or a
+        # constant section at an off-stride position would be missed
+        stride = self.prefilter_stride
+        if stride is not None and stride > 1:
+            if self.axis is None:
+                coarse = data[tuple(
+                    slice(None, None, stride) for _ in range(data.ndim))]
+                num_samples = coarse.size
+            else:
+                axis = self.axis % data.ndim
+                coarse = data[tuple(
+                    slice(None, None, stride) if d == axis else slice(None)
+                    for d in range(data.ndim))]
+                num_samples = coarse.shape[axis]
+            # the estimate is only meaningful if enough samples survive
+            # the striding: a reduction over one or two samples has a
+            # near-zero coefvar for any data and would decisively (and
+            # wrongly) reject a perfectly good batch
+            if num_samples >= 4:
+                coarse_coefvar = self._min_coefvar_exact(coarse)
+                if (coarse_coefvar > 2*self.min_coefvar
+                        or coarse_coefvar < 0.5*self.min_coefvar):
+                    return coarse_coefvar
+
+        return self._min_coefvar_exact(data)
+
+    def _min_coefvar_device(self, data, is_torch):
+        '''Coefvar of a GPU-resident array, computed with the reductions of
+        its own framework. Everything stays on the device; only the final
+        scalar is brought back to host for the threshold comparison.'''
+
+        if is_torch:
+            d = data.float()
+            if self.axis is None:
+                std, mean = d.std(unbiased=False), d.mean()
+            else:
+                std = d.std(dim=self.axis, unbiased=False)
+                mean = d.mean(dim=self.axis)
+            coefvar = std/mean.abs().clamp(min=1e-10)
+        else:
+            if data.dtype.kind != 'f':
+                data = data.astype('float32')
+            std = data.std(axis=self.axis)
+            mean = data.mean(axis=self.axis)
+            coefvar = std/abs(mean).clip(1e-10, None)
+        return float(coefvar.min())
+
+    def _min_coefvar_exact(self, data):
+
+        if _kernels.min_coefvar is not None:
+            if self.axis is None:
+                rows = data.reshape(1, -1)
+            else:
+                rows = np.moveaxis(data, self.axis, -1).reshape(
+                    -1, data.shape[self.axis])
+            if not rows.flags.c_contiguous:
+                rows = np.ascontiguousarray(rows)
+            return _kernels.min_coefvar(rows, self.min_coefvar)
+
+        # numpy fallback: a single sub-threshold position suffices to
+        # reject, so test coarse chunks one at a time and bail out as soon
+        # as one of them decides the rejection, without touching the rest
+        # of the array
+        if self.axis is not None and data.ndim >= 2:
+            # make the reduction axis the innermost one (a view, no copy),
+            # so the reductions run over contiguous memory
+            view = np.moveaxis(data, self.axis % data.ndim, -1)
+            min_coefvar = np.inf
+            for chunk in np.array_split(view, min(8, view.shape[0])):
+                if chunk.strides[-1] != chunk.itemsize:
+                    chunk = np.ascontiguousarray(chunk)
+                min_coefvar = min(
+                    min_coefvar, self._coefvar(chunk, axis=-1).min())
+                if min_coefvar <= self.min_coefvar:
+                    break
+            return min_coefvar
+
+        return float(self._coefvar(data, axis=self.axis))
+
+    def _coefvar(self, data, axis):
+        '''Coefficient of variation of ``data`` along ``axis``, computed as
+        ``E[X^2] - E[X]^2`` in two fused passes over the data instead of the
+        three that ``np.std`` plus ``np.mean`` would make. The accumulators
+        are float64: the shortcut formula cancels two almost-equal terms, so
+        (unlike a two-pass std) it cannot afford float32 sums; the bytes
+        read from the data itself stay in the input dtype either way.'''
+
+        if axis is None:
+            d = data.reshape(-1)
+        else:
+            # push the reduction axis innermost (a view, no copy)
+            d = np.moveaxis(data, axis, -1)
+        n = d.shape[-1]
+        out_shape = d.shape[:-1]
+
+        # rejected batches come in runs, so reuse the reduction outputs
+        # across the loop instead of allocating fresh result arrays per
+        # iteration; reallocate only if the batch shape changed
+        if self._std_buf is None or self._std_buf.shape != out_shape:
+            self._std_buf = np.empty(out_shape, dtype=np.float64)
+            self._mean_buf = np.empty(out_shape, dtype=np.float64)
+
+        sum_ = np.sum(d, axis=-1, dtype=np.float64, out=self._mean_buf)
+        # einsum fuses the square and the sum into a single pass
+        sumsq = np.einsum(
+            '...i,...i->...', d, d, dtype=np.float64, out=self._std_buf)
+
+        np.divide(sumsq, n, out=sumsq)
+        np.divide(sum_, n, out=sum_)
+        sumsq -= sum_*sum_
+        np.maximum(sumsq, 0, out=sumsq)
+        np.sqrt(sumsq, out=sumsq)
+        np.abs(sum_, out=sum_)
+        np.clip(sum_, 1e-10, None, out=sum_)
+        np.divide(sumsq, sum_, out=sumsq)
+        return sumsq
@@ -1,5 +1,6 @@
 from .provider_test import ProviderTest
 from gunpowder import *
+import numpy as np
 
 class TestNormalize(ProviderTest):
 
@@ -13,3 +14,16 @@ class TestNormalize(ProviderTest):
             raw = batch.arrays[ArrayKeys.RAW]
             self.assertTrue(raw.data.min() >= 0)
             self.assertTrue(raw.data.max() <= 1)
+
+    def test_float16(self):
+
+        pipeline = self.test_source + Normalize(
+            ArrayKeys.RAW, dtype=np.float16)
+
+        with build(pipeline):
+            batch = pipeline.request_batch(self.test_request)
+
+            raw = batch.arrays[ArrayKeys.RAW]
+            self.assertTrue(raw.data.dtype == np.float16)
+            self.assertTrue(raw.data.min() >= 0)
+            self.assertTrue(raw.data.max() <= 1)
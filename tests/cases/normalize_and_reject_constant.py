@@ -0,0 +1,34 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+from .reject_constant import ExampleSourceRejectConstant
+import numpy as np
+
+
+class TestNormalizeAndRejectConstant(ProviderTest):
+
+    def test_output(self):
+
+        pipeline = ExampleSourceRejectConstant() + NormalizeAndRejectConstant(
+            ArrayKeys.RAW)
+
+        with build(pipeline):
+
+            for _ in range(5):
+                batch = pipeline.request_batch(self.test_request)
+                raw = batch.arrays[ArrayKeys.RAW]
+                self.assertTrue(raw.data.dtype == np.float32)
+                self.assertTrue(raw.data.min() >= 0)
+                self.assertTrue(raw.data.max() <= 1)
+                self.assertTrue(raw.data.std() > 0)
+
+    def test_axis(self):
+
+        pipeline = ExampleSourceRejectConstant() + NormalizeAndRejectConstant(
+            ArrayKeys.RAW, axis=1)
+
+        with build(pipeline):
+
+            for _ in range(5):
+                batch = pipeline.request_batch(self.test_request)
+                data = batch.arrays[ArrayKeys.RAW].data
+                self.assertTrue(np.std(data, axis=1).min() > 0)